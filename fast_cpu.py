@@ -0,0 +1,31 @@
+import numba
+
+
+@numba.njit(parallel=True, fastmath=True)
+def add_noise(coords, noise, sqrt_alpha_cumprod, sqrt_one_minus_alpha_cumprod, out):
+    """Forward diffusion of coordinates on CPU, fused into a single parallel loop.
+
+    Writes sqrt(alpha_cumprod[t]) * coords + sqrt(1 - alpha_cumprod[t]) * noise into `out`
+    without intermediate arrays. All coordinate arrays must be C-contiguous.
+
+    Args:
+        coords: Clean coordinates of shape [B, N, num_atoms, 3].
+        noise: Gaussian noise with the same shape as `coords`.
+        sqrt_alpha_cumprod: Per-sample sqrt(alpha_cumprod[t]) of shape [B].
+        sqrt_one_minus_alpha_cumprod: Per-sample sqrt(1 - alpha_cumprod[t]) of shape [B].
+        out: Output array with the same shape as `coords`, written in place.
+
+    """
+    batch_size = coords.shape[0]
+    flat_coords = coords.reshape(batch_size, -1)
+    flat_noise = noise.reshape(batch_size, -1)
+    flat_out = out.reshape(batch_size, -1)
+    sample_size = flat_coords.shape[1]
+
+    for k in numba.prange(batch_size * sample_size):
+        b = k // sample_size
+        i = k - b * sample_size
+        flat_out[b, i] = (
+            sqrt_alpha_cumprod[b] * flat_coords[b, i]
+            + sqrt_one_minus_alpha_cumprod[b] * flat_noise[b, i]
+        )
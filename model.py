@@ -1,9 +1,31 @@
+from typing import Optional
+
 import numpy as np
 import torch
 from torch import nn
 
+try:
+    # NVIDIA apex provides a fused CUDA LayerNorm (falls back to PyTorch on CPU inputs)
+    from apex.normalization import FusedLayerNorm as LayerNorm
+except ImportError:
+    LayerNorm = nn.LayerNorm
+
+
+def inverse_frequencies(embed_dim, embed_size):
+    """Computes the inverse frequencies used by the sinusoidal positional encoding.
+
+    Args:
+        embed_dim: Dimension of the positional embeddings.
+        embed_size: A scaling factor that determines the frequency range of the embeddings.
+
+    Returns:
+        Tensor of shape [embed_dim // 2] with the inverse frequencies.
+    
+    """
+    return 1.0 / (embed_size ** (2 * torch.arange(embed_dim // 2, dtype=torch.float32) / embed_dim))
 
-def sinusoidal_positional_encoding(x, embed_dim, embed_size):
+
+def sinusoidal_positional_encoding(x, inv_freq):
     """Creates sine/cosine positional embeddings as described in the paper
     "Attention is All You Need" by Vaswani et al.
     
@@ -12,8 +34,8 @@ def sinusoidal_positional_encoding(x, embed_dim, embed_size):
 
     Args:
         x: Tensor of shape [B, N, N] or [B, N], representing input indices or positions.
-        embed_dim: Dimension of the positional embeddings.
-        embed_size: A scaling factor that determines the frequency range of the embeddings.
+        inv_freq: Inverse frequencies of shape [embed_dim // 2], as returned by
+            `inverse_frequencies`.
 
     Returns:
         Tensor with sinusoidal positional encodings.
@@ -22,18 +44,38 @@ def sinusoidal_positional_encoding(x, embed_dim, embed_size):
     
     """
     pi = np.pi
-    inv_freq = 1.0 / (embed_size ** (2 * torch.arange(embed_dim // 2, dtype=torch.float32) / embed_dim))
-    inv_freq = inv_freq.to(x.device)
 
     # Compute sinusoidal encoding
-    angles = x[..., None] * pi * inv_freq  # [..., embed_dim/2]
-    pos_embedding_sin = torch.sin(angles)  # Sine component
-    pos_embedding_cos = torch.cos(angles)  # Cosine component
+    angles = x.to(torch.float32)[..., None] * pi * inv_freq  # [..., embed_dim/2]
+    half_dim = angles.shape[-1]
 
-    pos_embedding = torch.cat([pos_embedding_sin, pos_embedding_cos], dim=-1)  # [..., embed_dim]
+    # Sine and cosine are written into the two halves of a single output buffer
+    pos_embedding = angles.new_empty(*angles.shape[:-1], 2 * half_dim)  # [..., embed_dim]
+    torch.sin(angles, out=pos_embedding[..., :half_dim])  # Sine component
+    torch.cos(angles, out=pos_embedding[..., half_dim:])  # Cosine component
     return pos_embedding
 
 
+class SinusoidalPositionalEncoding(nn.Module):
+    """Sine/cosine positional encoding with its inverse frequencies kept as a buffer,
+    so they are created once and live on the same device as the model.
+
+    """
+    def __init__(self, embed_dim, embed_size):
+        """Initializes the SinusoidalPositionalEncoding.
+
+        Args:
+            embed_dim (int): Dimension of the positional embeddings.
+            embed_size (int): A scaling factor that determines the frequency range of the embeddings.
+        """
+        super(SinusoidalPositionalEncoding, self).__init__()
+        self.register_buffer('inv_freq', inverse_frequencies(embed_dim, embed_size), persistent=False)
+
+    def forward(self, x):
+        """Encodes positions `x` of any shape into a tensor of shape [*x.shape, embed_dim]."""
+        return sinusoidal_positional_encoding(x, self.inv_freq)
+
+
 class ProteinDiffusionModel(nn.Module):
     """A denoising diffusion probabilistic model (DDPM) for protein backbone structure
     generation.
@@ -55,6 +97,7 @@ class ProteinDiffusionModel(nn.Module):
         beta_start: float = 0.0001,
         beta_end: float = 0.02,
         device: str = "cuda",
+        max_neighbor_offset: Optional[int] = None,
     ):
         """Initializes the ProteinDiffusionModel with the specified parameters.
 
@@ -69,6 +112,8 @@ class ProteinDiffusionModel(nn.Module):
             beta_start (float): Starting value for the noise schedule.
             beta_end (float): Ending value for the noise schedule.
             device (str): Device to run the model on
+            max_neighbor_offset (Optional[int]): If set, EGNN layers only pass messages between
+                residues at most this many positions apart in sequence. Defaults to all pairs.
         """
         super(ProteinDiffusionModel, self).__init__()
         self.device = device
@@ -86,6 +131,34 @@ class ProteinDiffusionModel(nn.Module):
         self.alpha_cumprod_prev = torch.cat(
             [torch.tensor([1.0], device=device), self.alpha_cumprod[:-1]]
         )   # α_{t-1}
+
+        # Square roots of the schedule, precomputed so that forward diffusion, the noise
+        # prediction and the reverse steps only gather per-timestep scalars
+        self.register_buffer('sqrt_alpha_cumprod', self.alpha_cumprod.sqrt(), persistent=False)
+        self.register_buffer(
+            'sqrt_one_minus_alpha_cumprod', (1 - self.alpha_cumprod).sqrt(), persistent=False
+        )
+        self.register_buffer('sqrt_alpha_cumprod_prev', self.alpha_cumprod_prev.sqrt(), persistent=False)
+        self.register_buffer(
+            'sqrt_one_minus_alpha_cumprod_prev', (1 - self.alpha_cumprod_prev).sqrt(), persistent=False
+        )
+
+        # Residue and timestep encodings only depend on integer indices, so they are
+        # precomputed once and looked up by index in the forward pass
+        self.residue_encoding = SinusoidalPositionalEncoding(hidden_size, max_residues)
+        self.time_encoding = SinusoidalPositionalEncoding(hidden_size, 10000)
+        self.register_buffer(
+            '_residue_table',
+            self.residue_encoding(torch.arange(max_residues, dtype=torch.float32)),
+            persistent=False,
+        )  # [max_residues, hidden_size]
+        self.register_buffer(
+            '_time_table',
+            self.time_encoding(
+                torch.arange(diffusion_steps, dtype=torch.float32) / diffusion_steps  # Normalize time to [0, 1]
+            ),
+            persistent=False,
+        )  # [diffusion_steps, hidden_size]
         
         # EGNN Layers
         self.egnn_layers = nn.ModuleList([
@@ -94,7 +167,8 @@ class ProteinDiffusionModel(nn.Module):
                 hidden_nf=hidden_size,
                 output_nf=hidden_size,
                 edge_embed_dim=edge_embed_dim,
-                max_len=self.max_residues
+                max_len=self.max_residues,
+                max_neighbor_offset=max_neighbor_offset,
             )
             for _ in range(num_egnn_layers)
         ])
@@ -104,8 +178,10 @@ class ProteinDiffusionModel(nn.Module):
 
         Args:
             coords (torch.Tensor): Input coordinates with shape [B, N, num_atoms, 3].
-            residue_indices (torch.Tensor): Residue indices with shape [B, N].
-            times (torch.Tensor): Time steps for diffusion with shape [B].
+            residue_indices (torch.Tensor): Residue positions in [0, max_residues) with shape
+                [B, N], e.g. author numbering shifted to start at 0, since the encoding tables
+                only cover that range.
+            times (torch.Tensor): Integer time steps for diffusion with shape [B].
             atom_mask (torch.Tensor): Mask for valid atoms with shape [B, N, num_atoms].
 
         Returns:
@@ -117,37 +193,43 @@ class ProteinDiffusionModel(nn.Module):
         
         """        
         batch_size, seq_len, num_atoms, coord_dim = coords.shape
+        if seq_len > self.max_residues:
+            raise ValueError(
+                f"Got {seq_len} residues, but the model encodes at most "
+                f"max_residues={self.max_residues}"
+            )
          
         # Residue index embedding
-        residue_embedding = sinusoidal_positional_encoding(
-            residue_indices.float(), embed_dim=self.hidden_size, embed_size=self.max_residues
-        )  # [B, N, hidden_size]
+        residue_embedding = self._residue_table[residue_indices]  # [B, N, hidden_size]
 
         # Time embedding
-        times = times.float() / self.diffusion_steps  # Normalize time to [0, 1]
-        time_embedding = sinusoidal_positional_encoding(times, self.hidden_size, 10000)  # [B, hidden_size]
+        time_embedding = self._time_table[times]  # [B, hidden_size]
         time_embedding = time_embedding.unsqueeze(1).expand(-1, seq_len, -1)  # [B, N, hidden_size]
 
         # Initial node features
         node_features = residue_embedding + time_embedding  # [B, N, hidden_size]
 
-        # Current coords (being updated)
-        curr_coords = coords.clone()
+        # Current coords (being updated). EGNN layers return new tensors rather than
+        # updating in place, so `coords` needs no defensive copy.
+        curr_coords = coords
         
         # Pass through EGNN layers
         for layer in self.egnn_layers:
             curr_coords, node_features = layer(curr_coords, node_features, atom_mask, residue_indices)
 
         # Compute predicted noise (e_t)
-        cum_a_t = self.alpha_cumprod[times.long()].unsqueeze(-1).unsqueeze(-1).unsqueeze(-1)  # [B, 1, 1, 1]
-        predicted_noise = (coords - torch.sqrt(cum_a_t) * curr_coords) / torch.sqrt(1 - cum_a_t) # DDPM formula
+        sqrt_cum_a_t = self.sqrt_alpha_cumprod[times].view(-1, 1, 1, 1)  # [B, 1, 1, 1]
+        sqrt_one_minus_cum_a_t = self.sqrt_one_minus_alpha_cumprod[times].view(-1, 1, 1, 1)  # [B, 1, 1, 1]
+        predicted_noise = (coords - sqrt_cum_a_t * curr_coords) / sqrt_one_minus_cum_a_t # DDPM formula
 
         return predicted_noise * atom_mask.unsqueeze(-1)
 
 
 class EGNNLayer(nn.Module):
     """Equivariant Graph Neural Network (EGNN) layer with directional vectors for rotation equivariance."""
-    def __init__(self, input_nf, hidden_nf, output_nf, edge_embed_dim=128, max_len=256):
+    def __init__(
+        self, input_nf, hidden_nf, output_nf, edge_embed_dim=128, max_len=256, max_neighbor_offset=None
+    ):
         """
         Initializes the EGNNLayer.
 
@@ -157,14 +239,47 @@ class EGNNLayer(nn.Module):
             output_nf (int): Dimensionality of output node features.
             edge_embed_dim (int): Dimensionality of edge embeddings (default: 16).
             max_len (int): Maximum number of residues in the protein sequence (default: 256).
+            max_neighbor_offset (int, optional): If set, only residue pairs with
+                |i - j| <= max_neighbor_offset exchange messages, which reduces the edge work
+                from N^2 to about N * (2 * max_neighbor_offset + 1) pairs. If None, all pairs
+                are used (default: None).
         """
         super(EGNNLayer, self).__init__()
         self.edge_embed_dim = edge_embed_dim
         self.max_len = max_len
 
+        # Encodings for every relative residue offset in [-(max_len - 1), max_len - 1]
+        self.edge_encoding = SinusoidalPositionalEncoding(edge_embed_dim, max_len)
+        self.register_buffer(
+            'rel_table',
+            self.edge_encoding(torch.arange(-(max_len - 1), max_len, dtype=torch.float32)),
+            persistent=False,
+        )  # [2 * max_len - 1, edge_embed_dim]
+
+        # Fixed edge list [2, E] of (receiving i, sending j) residue pairs for the
+        # sequence-local neighborhood, or None to use all pairs. Edges are sorted by
+        # max(i, j), so the edges of an N-residue input are the first num_edges[N] ones.
+        edge_index = None
+        self.num_edges = None
+        if max_neighbor_offset is not None:
+            positions = torch.arange(max_len)
+            in_range = (positions[:, None] - positions[None, :]).abs() <= max_neighbor_offset
+            edge_index = torch.stack(torch.nonzero(in_range, as_tuple=True))
+            last_node = edge_index.max(dim=0).values
+            edge_index = edge_index[:, torch.argsort(last_node, stable=True)]
+            self.num_edges = [0] + torch.bincount(last_node, minlength=max_len).cumsum(0).tolist()
+        self.register_buffer('edge_index', edge_index, persistent=False)
+
+        # First edge MLP layer, split over the edge feature groups (node i, node j,
+        # relative residue encoding, directional vector) so that each group is
+        # projected before broadcasting over residue pairs
+        self.lin_i = nn.Linear(input_nf, hidden_nf)
+        self.lin_j = nn.Linear(input_nf, hidden_nf, bias=False)
+        self.lin_e = nn.Linear(edge_embed_dim, hidden_nf, bias=False)
+        self.lin_d = nn.Linear(3, hidden_nf, bias=False)  # 3 for directional vector
+
         # Edge feature MLP
         self.edge_mlp = nn.Sequential(
-            nn.Linear(2 * input_nf + edge_embed_dim + 3, hidden_nf),  # +3 for directional vector
             nn.SiLU(),
             nn.Linear(hidden_nf, hidden_nf),
             nn.SiLU(),
@@ -176,7 +291,7 @@ class EGNNLayer(nn.Module):
             nn.SiLU(),
             nn.Linear(hidden_nf, output_nf),
         )
-        self.node_norm = nn.LayerNorm(output_nf)
+        self.node_norm = LayerNorm(output_nf)
 
         # Coordinate update MLP
         self.coord_mlp = nn.Sequential(
@@ -185,6 +300,33 @@ class EGNNLayer(nn.Module):
             nn.Linear(hidden_nf, 1),
         )
 
+    def _load_from_state_dict(
+        self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs
+    ):
+        """Loads checkpoints saved before the first edge layer was split.
+
+        Those store it as `edge_mlp.0`, a single linear layer over the concatenated
+        [h_i, h_j, rel_enc, dir] edge features, and the second edge linear as `edge_mlp.2`.
+        Its weight columns are split into `lin_i`, `lin_j`, `lin_e` and `lin_d` (the bias goes
+        to `lin_i`), and `edge_mlp.2` is renamed to `edge_mlp.1`.
+        """
+        weight = state_dict.pop(prefix + 'edge_mlp.0.weight', None)
+        if weight is not None:
+            split_sizes = [
+                self.lin_i.in_features, self.lin_j.in_features, self.lin_e.in_features, self.lin_d.in_features
+            ]
+            for name, w in zip(('lin_i', 'lin_j', 'lin_e', 'lin_d'), torch.split(weight, split_sizes, dim=1)):
+                state_dict[prefix + name + '.weight'] = w
+            if prefix + 'edge_mlp.0.bias' in state_dict:
+                state_dict[prefix + 'lin_i.bias'] = state_dict.pop(prefix + 'edge_mlp.0.bias')
+            for name in ('weight', 'bias'):
+                if prefix + 'edge_mlp.2.' + name in state_dict:
+                    state_dict[prefix + 'edge_mlp.1.' + name] = state_dict.pop(prefix + 'edge_mlp.2.' + name)
+
+        super(EGNNLayer, self)._load_from_state_dict(
+            state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs
+        )
+
     def forward(self, coords, node_features, atom_mask, residue_indices):
         """
         Forward pass through the EGNNLayer.
@@ -203,43 +345,150 @@ class EGNNLayer(nn.Module):
         """
         batch_size, seq_len, num_atoms, coord_dim = coords.shape
 
-        # Compute relative residue index differences
-        rel_residue_indices = residue_indices[:, :, None] - residue_indices[:, None, :]  # [B, N, N]
-        rel_residue_enc = sinusoidal_positional_encoding(
-            rel_residue_indices, self.edge_embed_dim, self.max_len)  # [B, N, N, edge_embed_dim]
-
-        # Compute directional vectors
-        directional_vectors = coords[:, :, None, :, :] - coords[:, None, :, :, :]  # [B, N, N, num_atoms, 3]
-        directional_vectors = directional_vectors.mean(dim=3)  # Mean over atoms, shape [B, N, N, 3]
-
-        # Concatenate edge features
-        edge_features = torch.cat(
-            [
-                node_features[:, :, None, :].expand(-1, -1, seq_len, -1),  # Node features i
-                node_features[:, None, :, :].expand(-1, seq_len, -1, -1),  # Node features j
-                rel_residue_enc,                                           
-                directional_vectors,                                       
-            ],
-            dim=-1,
-        )  # [B, N, N, 2 * input_nf + edge_embed_dim + 3]
-
-        # Process edge features through MLP
-        edge_messages = self.edge_mlp(edge_features)  # [B, N, N, hidden_nf]
+        # Project the offset table before gathering, so the per-pair relative residue
+        # encoding is never built
+        rel_table_proj = self.lin_e(self.rel_table)  # [2 * max_len - 1, hidden_nf]
+
+        # Directional vectors are computed from the per-residue mean positions: the mean
+        # over atoms of x_i - x_j equals c_i - c_j
+        centroids = coords.mean(dim=2)  # Mean over atoms, shape [B, N, 3]
+
+        # c_i - c_j does not change when every centroid is shifted, so they are centred on
+        # their own mean in each sample. The per-residue terms below are then of the size of
+        # the protein rather than of its absolute position, which keeps them accurate under
+        # bf16/TF32 and the layer translation invariant in practice. The centre is taken over
+        # the centroids themselves, not the valid atoms, since the centroids also average the
+        # masked (typically zero) atom slots.
+        centroids = centroids - centroids.mean(dim=1, keepdim=True)  # [B, N, 3]
+
+        # Directional vectors are antisymmetric and lin_d has no bias, so
+        # W_d·dir_ij = W_d·c_i - W_d·c_j is projected per residue and folded into the
+        # node projections instead of being applied to every pair
+        proj_d = self.lin_d(centroids)  # [B, N, hidden_nf]
+
+        # First edge layer: W_i·h_i + W_j·h_j + W_e·rel_enc + W_d·dir + b, equivalent to
+        # a linear layer over the concatenated 2 * input_nf + edge_embed_dim + 3 edge
+        # features without materializing them
+        proj_i = self.lin_i(node_features) + proj_d  # [B, N, hidden_nf]
+        proj_j = self.lin_j(node_features) - proj_d  # [B, N, hidden_nf]
+
+        if self.edge_index is None:
+            aggregated_messages, coord_updates = self._aggregate_dense(
+                proj_i, proj_j, rel_table_proj, centroids, residue_indices
+            )
+        else:
+            aggregated_messages, coord_updates = self._aggregate_sparse(
+                proj_i, proj_j, rel_table_proj, centroids, residue_indices
+            )
 
-        # Aggregate messages for nodes
-        aggregated_messages = edge_messages.sum(dim=2)  # [B, N, hidden_nf]
         updated_node_features = self.node_mlp(
             torch.cat([node_features, aggregated_messages], dim=-1)
         )  # [B, N, output_nf]
-        updated_node_features = self.node_norm(updated_node_features)
 
-        # Coordinate updates using directional vectors
-        coord_updates = self.coord_mlp(edge_messages)  # [B, N, N, 1]
-        coord_updates = coord_updates * directional_vectors 
-        coord_updates = coord_updates.sum(dim=2)  # Aggregate over neighbors, [B, N, 3]
+        # Normalize in at least fp32 with autocast disabled: apex FusedLayerNorm would
+        # otherwise cast its input to the autocast dtype
+        with torch.autocast(device_type=updated_node_features.device.type, enabled=False):
+            updated_node_features = self.node_norm(
+                updated_node_features.to(torch.promote_types(updated_node_features.dtype, torch.float32))
+            )
 
         # Update coordinates
         updated_coords = coords + coord_updates.unsqueeze(2) * atom_mask.unsqueeze(-1)  # [B, N, num_atoms, 3]
 
         return updated_coords, updated_node_features
 
+    def _aggregate_dense(self, proj_i, proj_j, rel_table_proj, centroids, residue_indices):
+        """Computes edge messages for all residue pairs and aggregates them per node.
+
+        Args:
+            proj_i (torch.Tensor): Projected features of receiving nodes, shape [B, N, hidden_nf].
+            proj_j (torch.Tensor): Projected features of sending nodes, shape [B, N, hidden_nf].
+            rel_table_proj (torch.Tensor): Projected relative offset table,
+                shape [2 * max_len - 1, hidden_nf].
+            centroids (torch.Tensor): Per-residue mean atom positions, shape [B, N, 3].
+            residue_indices (torch.Tensor): Residue indices, of shape [B, N].
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]:
+                - aggregated_messages: Sum of incoming messages, shape [B, N, hidden_nf].
+                - coord_updates: Aggregated coordinate updates, shape [B, N, 3].
+        """
+        # Compute relative residue index differences
+        rel_residue_indices = residue_indices[:, :, None] - residue_indices[:, None, :]  # [B, N, N]
+        rel_residue_proj = rel_table_proj[rel_residue_indices + self.max_len - 1]  # [B, N, N, hidden_nf]
+
+        # Node projections are broadcast-added in place onto the gathered offset term, so
+        # the three edge feature groups share a single [B, N, N, hidden_nf] buffer
+        edge_features = rel_residue_proj
+        edge_features += proj_i[:, :, None, :]     # Node features i
+        edge_features += proj_j[:, None, :, :]     # Node features j
+
+        # Process edge features through MLP
+        edge_messages = self.edge_mlp(edge_features)  # [B, N, N, hidden_nf]
+
+        # Aggregate messages for nodes, in at least fp32 also when running under autocast
+        aggregated_messages = edge_messages.sum(
+            dim=2, dtype=torch.promote_types(edge_messages.dtype, torch.float32)
+        )  # [B, N, hidden_nf]
+
+        # Coordinate updates using directional vectors. With dir_ij = c_i - c_j,
+        # sum_j w_ij·dir_ij = c_i·sum_j w_ij - sum_j w_ij·c_j, so the reduction only needs
+        # the [B, N, N] weights and never builds pairwise [B, N, N, 3] vectors
+        coord_weights = self.coord_mlp(edge_messages).squeeze(-1)  # [B, N, N]
+
+        # The two terms partially cancel, so the contraction runs in the (at least fp32)
+        # precision of the coordinates, with autocast disabled
+        with torch.autocast(device_type=coord_weights.device.type, enabled=False):
+            coord_weights = coord_weights.to(centroids.dtype)
+            coord_updates = (
+                centroids * coord_weights.sum(dim=-1, keepdim=True) - coord_weights @ centroids
+            )  # [B, N, 3]
+
+        return aggregated_messages, coord_updates
+
+    def _aggregate_sparse(self, proj_i, proj_j, rel_table_proj, centroids, residue_indices):
+        """Computes edge messages along `edge_index` only and scatter-adds them per node.
+
+        Args:
+            proj_i (torch.Tensor): Projected features of receiving nodes, shape [B, N, hidden_nf].
+            proj_j (torch.Tensor): Projected features of sending nodes, shape [B, N, hidden_nf].
+            rel_table_proj (torch.Tensor): Projected relative offset table,
+                shape [2 * max_len - 1, hidden_nf].
+            centroids (torch.Tensor): Per-residue mean atom positions, shape [B, N, 3].
+            residue_indices (torch.Tensor): Residue indices, of shape [B, N].
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]:
+                - aggregated_messages: Sum of incoming messages, shape [B, N, hidden_nf].
+                - coord_updates: Aggregated coordinate updates, shape [B, N, 3].
+        """
+        batch_size, seq_len, hidden_nf = proj_i.shape
+        edge_i, edge_j = self.edge_index[:, :self.num_edges[seq_len]]  # [E], [E]
+
+        # Compute relative residue index differences
+        rel_residue_indices = residue_indices[:, edge_i] - residue_indices[:, edge_j]  # [B, E]
+        rel_residue_proj = rel_table_proj[rel_residue_indices + self.max_len - 1]  # [B, E, hidden_nf]
+
+        # Compute directional vectors
+        directional_vectors = centroids[:, edge_i] - centroids[:, edge_j]  # [B, E, 3]
+
+        edge_features = rel_residue_proj  # [B, E, hidden_nf]
+        edge_features += proj_i[:, edge_i]  # Node features i
+        edge_features += proj_j[:, edge_j]  # Node features j
+
+        # Process edge features through MLP
+        edge_messages = self.edge_mlp(edge_features)  # [B, E, hidden_nf]
+
+        # Aggregate messages for nodes, in at least fp32 also when running under autocast
+        accumulate_dtype = torch.promote_types(edge_messages.dtype, torch.float32)
+        aggregated_messages = torch.zeros(
+            batch_size, seq_len, hidden_nf, device=edge_messages.device, dtype=accumulate_dtype
+        ).index_add_(1, edge_i, edge_messages.to(accumulate_dtype))  # [B, N, hidden_nf]
+
+        # Coordinate updates using directional vectors
+        coord_weights = self.coord_mlp(edge_messages)  # [B, E, 1]
+        coord_updates = centroids.new_zeros(batch_size, seq_len, 3).index_add_(
+            1, edge_i, coord_weights * directional_vectors
+        )  # [B, N, 3]
+
+        return aggregated_messages, coord_updates
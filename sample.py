@@ -3,7 +3,9 @@ from tqdm import tqdm
 
 
 def sample_protein_backbone(
-    model, diffusion_steps, max_residues, device='cuda', init_scale=1.0, noise_scale=1.0
+    model, diffusion_steps, max_residues, device='cuda', init_scale=1.0, noise_scale=1.0,
+    compile_model=False, mixed_precision=True, num_samples=1, use_cuda_graph=False,
+    num_inference_steps=50,
 ):
     """Generate a protein backbone using the diffusion model with integrated reconstruction.
 
@@ -13,65 +15,140 @@ def sample_protein_backbone(
         max_residues: Maximum residues in the sequence.
         device: Device to run the sampling on ('cuda' or 'cpu').
         init_scale: Initial noise scale for coordinates.
-        noise_scale: Noise scale during reverse diffusion steps.
+        noise_scale: Noise scale during reverse diffusion steps (DDPM sampling only).
+        compile_model: If True, runs the model through `torch.compile` to fuse its many
+            small elementwise ops into fewer kernels.
+        mixed_precision: If True and sampling on CUDA, runs the model forward under bf16
+            autocast. The noise schedule arithmetic always stays in fp32.
+        num_samples: Number of backbones generated in parallel as one batch.
+        use_cuda_graph: If True, captures one reverse step into a CUDA graph and replays it
+            for every timestep, removing per-step kernel launch overhead. Requires CUDA.
+        num_inference_steps: Number of evenly spaced timesteps visited by deterministic DDIM
+            sampling. If None, runs DDPM ancestral sampling over all `diffusion_steps`.
 
     Returns:
-        Generated full atomic coordinates (with non-backbone atoms set to zero) as a NumPy array.
+        Generated full atomic coordinates (with non-backbone atoms set to zero) as a NumPy array
+        of shape [num_samples, max_residues, num_atoms, 3].
     
     """
     model.eval()
 
+    # Shapes are fixed for the whole sampling loop, so dynamic shapes are disabled
+    denoiser = torch.compile(model, dynamic=False) if compile_model else model
+
     num_atoms = model.num_atoms  # to ensure cnsistency with model params
     backbone_indices = [0, 1, 2, 4]  # Indices for (N, CA, C, O)
 
     # Initialize random noisy coordinates
-    coords = torch.randn(1, max_residues, num_atoms, 3, device=device) * init_scale
-    residue_indices = torch.arange(max_residues, device=device).unsqueeze(0)
+    coords = torch.randn(num_samples, max_residues, num_atoms, 3, device=device) * init_scale
+    residue_indices = torch.arange(max_residues, device=device, dtype=torch.int32)
+    residue_indices = residue_indices.unsqueeze(0).expand(num_samples, -1)
 
     # atom mask for (N, CA, C, O)
-    atom_mask = torch.zeros(1, max_residues, num_atoms, device=device)
+    atom_mask = torch.zeros(num_samples, max_residues, num_atoms, device=device)
     atom_mask[:, :, backbone_indices] = 1
 
-    # Sampling loop
-    alpha_cumprod_prev = model.alpha_cumprod_prev
-
-    with torch.no_grad():
-        for t in tqdm(range(diffusion_steps - 1, -1, -1), desc="Sampling"):
-            t_tensor = torch.tensor([t], device=device).long()
-
-            # Predict noise added to the coordinates
-            predicted_noise = model(coords, residue_indices, t_tensor, atom_mask)
-
-            # Compute mean for x_{t-1}
-            alpha_t_prev = alpha_cumprod_prev[t].view(1, 1, 1, 1)
-            alpha_t = model.alpha_cumprod[t].view(1, 1, 1, 1)
+    # Sampling schedule. Both samplers update x_{t-1} = a·x_t + b·predicted_noise (+ noise),
+    # so only the per-step coefficients [a, b] differ.
+    if num_inference_steps is None:
+        # DDPM: every timestep, with noise added for t > 0
+        timesteps = torch.arange(diffusion_steps - 1, -1, -1)
+        t_idx = timesteps.to(device)
+        sqrt_a_t = model.sqrt_alpha_cumprod[t_idx]
+        coef_coords = model.sqrt_alpha_cumprod_prev[t_idx] / sqrt_a_t
+        coef_noise = -model.sqrt_one_minus_alpha_cumprod_prev[t_idx] / sqrt_a_t
+    else:
+        # DDIM: x_prev = sqrt(a_prev)·x0_pred + sqrt(1 - a_prev)·predicted_noise, with
+        # x0_pred = (x_t - sqrt(1 - a_t)·predicted_noise) / sqrt(a_t) and a_prev = 1
+        # after the last step
+        timesteps = torch.linspace(diffusion_steps - 1, 0, num_inference_steps).long()
+        t_idx = timesteps.to(device)
+        sqrt_a_t = model.sqrt_alpha_cumprod[t_idx]
+        sqrt_one_minus_a_t = model.sqrt_one_minus_alpha_cumprod[t_idx]
+        sqrt_a_prev = torch.cat([sqrt_a_t[1:], sqrt_a_t.new_ones(1)])
+        sqrt_one_minus_a_prev = torch.cat([sqrt_one_minus_a_t[1:], sqrt_a_t.new_zeros(1)])
+        coef_coords = sqrt_a_prev / sqrt_a_t
+        coef_noise = sqrt_one_minus_a_prev - sqrt_a_prev * sqrt_one_minus_a_t / sqrt_a_t
+    step_coefs = torch.stack([coef_coords, coef_noise], dim=-1)  # [num_steps, 2]
+    timesteps = timesteps.tolist()
+    num_steps = len(timesteps)
+
+    # Timestep, step index and noise are written in place every step, so that a captured
+    # CUDA graph can read them from fixed addresses
+    t_tensor = torch.zeros(num_samples, device=device, dtype=torch.long)
+    step_index = torch.zeros(1, device=device, dtype=torch.long)
+    z = torch.zeros_like(coords)
+
+    def reverse_step(coords):
+        """Computes x_{t-1} from x_t for the current `t_tensor`, `step_index` and noise `z`."""
+        # Predict noise added to the coordinates
+        predicted_noise = denoiser(coords, residue_indices, t_tensor, atom_mask).float()
+
+        # Compute x_{t-1}. Gathering with a 1-D device index (rather than unpacking a
+        # 0-dim index) avoids a host sync, which would also break CUDA graph capture.
+        coef_coords, coef_noise = step_coefs.index_select(0, step_index).unbind(-1)  # [1] each
+        next_coords = coef_coords * coords + coef_noise * predicted_noise + z
+
+        # Clip coordinates to a reasonable range
+        return torch.clamp(next_coords, min=-10.0, max=10.0)
+
+    # bf16 autocast halves the memory traffic through the EGNN edge tensors. The
+    # autocast weight cache is not allowed inside CUDA graph capture.
+    device_type = torch.device(device).type
+    autocast = torch.autocast(
+        device_type=device_type, dtype=torch.bfloat16,
+        enabled=mixed_precision and device_type == 'cuda', cache_enabled=not use_cuda_graph,
+    )
+
+    # Coordinate statistics logged at every tenth of the schedule (including the final
+    # step) are kept on device and reported after the loop, so sampling never waits on a
+    # host sync
+    log_stride = max(num_steps // 10, 1)
+    log_steps = [i for i in range(num_steps) if (num_steps - 1 - i) % log_stride == 0]
+    stats = torch.empty(len(log_steps), 2, device=device)  # [mean, std] per logged step
 
-            mean_coords = (
-                torch.sqrt(alpha_t_prev) * coords -
-                torch.sqrt(1 - alpha_t_prev) * predicted_noise
-            ) / torch.sqrt(alpha_t)
-
-            # Add noise for t > 0
-            if t > 0:
-                z = torch.randn_like(coords) * noise_scale
+    # Sampling loop
+    with autocast, torch.no_grad():
+        graph = None
+        if use_cuda_graph:
+            # Warm up on a side stream before capture, as required by CUDA graphs
+            side_stream = torch.cuda.Stream()
+            side_stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(side_stream):
+                for _ in range(3):
+                    reverse_step(coords)
+            torch.cuda.current_stream().wait_stream(side_stream)
+
+            # Each replay advances `coords` in place by one reverse step
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                coords.copy_(reverse_step(coords))
+
+        for i, t in enumerate(tqdm(timesteps, desc="Sampling")):
+            t_tensor.fill_(t)
+            step_index.fill_(i)
+
+            # Add noise for t > 0 (DDPM only, DDIM is deterministic)
+            if num_inference_steps is None:
+                if t > 0:
+                    z.normal_(std=noise_scale)
+                else:
+                    z.zero_()  # No noise at final step
+
+            if graph is not None:
+                graph.replay()
             else:
-                z = torch.zeros_like(coords)  # No noise at final step
-
-            coords = mean_coords + z
-
-            # Apply atom mask to preserve backbone structure
-            coords = coords * atom_mask.unsqueeze(-1) + (1 - atom_mask.unsqueeze(-1)) * coords
+                coords = reverse_step(coords)
 
-            # Clip coordinates to a reasonable range
-            coords = torch.clamp(coords, min=-10.0, max=10.0)
+            if i in log_steps:
+                coords_std, coords_mean = torch.std_mean(coords)
+                stats[log_steps.index(i)] = torch.stack([coords_mean, coords_std])
 
-            # Logging every 100 steps or at the final step
-            if t % 100 == 0 or t == 0:
-                print(f"Step {t}: Coords mean={coords.mean().item():.4f}, std={coords.std().item():.4f}")
+    for i, (coords_mean, coords_std) in zip(log_steps, stats.tolist()):
+        print(f"Step {timesteps[i]}: Coords mean={coords_mean:.4f}, std={coords_std:.4f}")
 
     # non-backbone atom coordinates to zero
     coords = coords * atom_mask.unsqueeze(-1)
-    coords = coords.squeeze(0) # Remove batch dimension
 
     return coords.cpu().detach().numpy()
 
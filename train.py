@@ -5,6 +5,12 @@ from exazyme.tk.Denoising_Diffusion_Repo.model import ProteinDiffusionModel
 from torch import nn, optim
 from tqdm import tqdm
 
+try:
+    # Optional numba kernel for the forward diffusion when training on CPU
+    from exazyme.tk.Denoising_Diffusion_Repo.fast_cpu import add_noise
+except ImportError:
+    add_noise = None
+
 
 class Config():
   def __init__(self):
@@ -13,6 +19,7 @@ class Config():
     self.hidden_size = 128
     self.edge_embed_dim = 128
     self.num_egnn_layers = 4
+    self.max_neighbor_offset = None  # None to pass messages between all residue pairs
     self.batch_size = 8
 
 
@@ -79,6 +86,14 @@ diffusion_steps = 1000
 beta_start = 0.0001
 beta_end = 0.02
 
+# Run the model forward under bf16 autocast on CUDA. bf16 has the fp32 exponent range,
+# so no GradScaler is needed.
+mixed_precision = True
+
+# Let fp32 matmuls and convolutions outside autocast use TF32 tensor cores
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+
 checkpoint_path = "checkpoint.pth"
 
 # If resume_training is True and a checkpoint exists, load the model, optimizer,
@@ -93,11 +108,18 @@ model = ProteinDiffusionModel(
     hidden_size=cfg.hidden_size,
     edge_embed_dim=cfg.edge_embed_dim,
     num_egnn_layers=cfg.num_egnn_layers,
+    max_neighbor_offset=cfg.max_neighbor_offset,
     device=device,
     beta_start=beta_start,
     beta_end=beta_end,
 ).to(device)
 
+# Batches are expected to be padded to cfg.max_seq_length (see `train_loader`), so input
+# shapes are static and dynamic shapes are disabled to allow more fusion. Batches of other
+# lengths still work, but each new length triggers a recompile. Checkpoints are saved from
+# the uncompiled `model`.
+compiled_model = torch.compile(model, dynamic=False)
+
 optimizer = optim.Adam(model.parameters(), lr=learning_rate)
 loss_fn = nn.MSELoss(reduction='none')
 
@@ -109,13 +131,16 @@ class Config():
     self.hidden_size = 256
     self.edge_embed_dim = 256
     self.num_egnn_layers = 4
+    self.max_neighbor_offset = None  # None to pass messages between all residue pairs
     self.batch_size = 4 # 64
 
 
 cfg = Config()
 
-# Placeholder for a data loader that yields batches containing keys: 'residue_index', 
-# 'atom_mask', and 'atom_positions'
+# Placeholder for a data loader that yields batches containing keys: 'residue_index',
+# 'atom_mask', and 'atom_positions', padded to cfg.max_seq_length residues. Residue
+# numbering may start anywhere and keep its gaps (chain breaks), but each chain must span
+# fewer than cfg.max_seq_length positions.
 train_loader = None 
 
 # Training loop
@@ -128,12 +153,24 @@ if resume_training and os.path.exists(checkpoint_path):
 
 for epoch in range(start_epoch, num_epochs):
     model.train()
-    epoch_loss = 0
-    total_samples = 0  # Track the total number of valid atoms for normalization
+    # Accumulated on device, so the loop does not sync with the host every batch
+    epoch_loss = torch.zeros((), device=device)
+    total_samples = torch.zeros((), device=device)  # Track the total number of valid atoms for normalization
     progress_bar = tqdm(train_loader, desc=f"Epoch {epoch + 1}/{num_epochs}")
 
     for batch in progress_bar:
-        residue_indices = batch['residue_index'].to(device)  # Shape: [B, N]
+        # Residue numbering is shifted to start at 0 per chain, keeping its gaps, since the
+        # model's encoding tables only cover indices in [0, max_residues). The range is
+        # checked before moving to the device, so it needs no device sync. int32 is enough
+        # for lookup indices.
+        residue_indices = batch['residue_index']  # Shape: [B, N]
+        residue_indices = residue_indices - residue_indices.min(dim=1, keepdim=True).values
+        if residue_indices.max() >= model.max_residues:
+            raise ValueError(
+                f"Residue numbering spans more than max_residues={model.max_residues} "
+                f"positions within a chain"
+            )
+        residue_indices = residue_indices.to(device, torch.int32)
         atom_mask = batch['atom_mask'].to(device)  # Shape: [B, N, num_atoms]
         coords = batch['atom_positions'].to(device)  # Shape: [B, N, num_atoms, 3]
 
@@ -141,19 +178,36 @@ for epoch in range(start_epoch, num_epochs):
         t = torch.randint(0, diffusion_steps, (coords.size(0),), device=device)  # Shape: [B]
 
         # Add noise using the forward diffusion process
-        noise = torch.randn_like(coords)  # [B, N, num_atoms, 3]
-        alpha_cumprod = model.alpha_cumprod[t].view(-1, 1, 1, 1)  # Shape: [B, 1, 1, 1]
-        noisy_coords = torch.sqrt(alpha_cumprod) * coords + torch.sqrt(1 - alpha_cumprod) * noise  # [B, N, num_atoms, 3]
+        noise = torch.randn_like(coords, memory_format=torch.contiguous_format)  # [B, N, num_atoms, 3]
+        sqrt_alpha_cumprod = model.sqrt_alpha_cumprod[t]  # Shape: [B]
+        sqrt_one_minus_alpha_cumprod = model.sqrt_one_minus_alpha_cumprod[t]  # Shape: [B]
+        if add_noise is not None and coords.device.type == 'cpu':
+            # The numba kernel needs C-contiguous arrays, whatever the layout of the batch
+            noisy_coords = torch.empty_like(coords, memory_format=torch.contiguous_format)  # [B, N, num_atoms, 3]
+            add_noise(
+                coords.contiguous().numpy(), noise.numpy(),
+                sqrt_alpha_cumprod.numpy(), sqrt_one_minus_alpha_cumprod.numpy(),
+                noisy_coords.numpy(),
+            )
+        else:
+            noisy_coords = torch.addcmul(
+                sqrt_alpha_cumprod.view(-1, 1, 1, 1) * coords,
+                sqrt_one_minus_alpha_cumprod.view(-1, 1, 1, 1),
+                noise,
+            )  # [B, N, num_atoms, 3]
 
         # Forward pass: predict noise and reconstructed coordinates
-        predicted_noise = model(noisy_coords, residue_indices, t, atom_mask)  # [B, N, num_atoms, 3]
+        with torch.autocast(
+            device_type='cuda', dtype=torch.bfloat16, enabled=mixed_precision and coords.is_cuda
+        ):
+            predicted_noise = compiled_model(noisy_coords, residue_indices, t, atom_mask)  # [B, N, num_atoms, 3]
 
         # Compute noise prediction loss
         loss = loss_fn(predicted_noise, noise)  # [B, N, num_atoms, 3]
         loss = (loss * atom_mask.unsqueeze(-1)).sum()
 
-        epoch_loss += loss.item()
-        total_samples += atom_mask.sum().item()  # Accumulate total valid atoms
+        epoch_loss += loss.detach()
+        total_samples += atom_mask.sum()  # Accumulate total valid atoms
 
         # Backpropagation
         optimizer.zero_grad()
@@ -161,7 +215,7 @@ for epoch in range(start_epoch, num_epochs):
         optimizer.step()
 
     # Normalize training loss by the total number of valid atoms
-    avg_train_loss = epoch_loss / total_samples
+    avg_train_loss = (epoch_loss / total_samples).item()
 
     print(f"Epoch {epoch + 1}/{num_epochs}, Train Loss: {avg_train_loss:.4f}")
 